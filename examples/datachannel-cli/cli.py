@@ -105,6 +105,8 @@ if __name__ == "__main__":
 
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
 
     signaling = create_signaling(args)
     pc = RTCPeerConnection()
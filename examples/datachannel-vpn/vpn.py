@@ -87,6 +87,8 @@ if __name__ == "__main__":
 
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
 
     tap = tuntap.Tun(name="revpn-%s" % args.role)
 
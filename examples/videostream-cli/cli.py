@@ -1,8 +1,14 @@
 import argparse
 import asyncio
+import concurrent.futures
+import functools
+import itertools
 import logging
 import math
+import tempfile
+import time
 import boto3
+import botocore.config
 
 import cv2
 import numpy
@@ -12,11 +18,139 @@ from aiortc import (
     RTCSessionDescription,
     VideoStreamTrack,
 )
+from aiortc.codecs.h264 import DEFAULT_BITRATE, create_encoder_context
 from aiortc.contrib.media import MediaBlackhole, MediaPlayer, MediaRecorder
 from aiortc.contrib.signaling import BYE, add_signaling_arguments, create_signaling
+from aiortc.mediastreams import VIDEO_CLOCK_RATE, VIDEO_TIME_BASE, MediaStreamError
 from av import VideoFrame
 from aiortc.rtcconfiguration import RTCIceServer, RTCConfiguration
-import os, sys, datetime, hashlib, hmac, urllib.parse
+from aiortc.rtcrtpsender import RTCRtpSender
+import os, sys, hashlib, hmac, urllib.parse
+
+# optional, for better performance
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+logger = logging.getLogger("cli")
+
+# bump the version whenever the rendering of the flag changes
+FLAG_CACHE_PATH = os.path.join(tempfile.gettempdir(), "aiortc-flag-640x480x30-v2.npy")
+FLAG_SHAPE = (30, 480, 640, 3)
+
+
+@functools.lru_cache(maxsize=1)
+def _build_flag_frames():
+    """
+    Return the images of the animated flag, which are shared by all tracks.
+
+    The images are cached on disk so that later runs only need to map them,
+    set AIORTC_FLAG_CACHE=0 in the environment to disable this.
+    """
+    use_cache = os.environ.get("AIORTC_FLAG_CACHE") != "0"
+    if use_cache:
+        try:
+            images = numpy.load(FLAG_CACHE_PATH, mmap_mode="r")
+        except (OSError, ValueError):
+            pass
+        else:
+            if images.shape == FLAG_SHAPE and images.dtype == numpy.uint8:
+                return list(images)
+
+    images = _render_flag()
+    images.flags.writeable = False
+    if use_cache:
+        _save_flag(images)
+    return list(images)
+
+
+def _save_flag(images):
+    # write to a temporary file first, so no other process sees a partial file
+    try:
+        fd, path = tempfile.mkstemp(dir=os.path.dirname(FLAG_CACHE_PATH), suffix=".npy")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                numpy.save(f, images)
+            os.replace(path, FLAG_CACHE_PATH)
+        except OSError:
+            os.unlink(path)
+            raise
+    except OSError:
+        logger.warning("Could not cache the flag to %s", FLAG_CACHE_PATH)
+
+
+def _render_flag():
+    _, height, width, _ = FLAG_SHAPE
+
+    # generate flag, directly shrunk to half size and centered
+    data_bgr = numpy.zeros((height, width, 3), numpy.uint8)
+    data_bgr[120:360, 160:267] = (255, 0, 0)  # blue
+    data_bgr[120:360, 267:374] = (255, 255, 255)  # white
+    data_bgr[120:360, 374:480] = (0, 0, 255)  # red
+
+    # compute animation
+    omega = 2 * math.pi / height
+    id_x = numpy.broadcast_to(numpy.arange(width, dtype=numpy.float32), (height, width))
+    id_y = numpy.broadcast_to(
+        numpy.arange(height, dtype=numpy.float32)[:, None], (height, width)
+    )
+
+    # the wave only depends on x, so evaluate it once for all 30 phases
+    phases = numpy.arange(30, dtype=numpy.float32) * numpy.float32(2 * math.pi / 30)
+    wave = numpy.float32(omega) * id_x[0] + phases[:, None]
+    offset_x = 10 * numpy.cos(wave)
+    offset_y = 10 * numpy.sin(wave)
+
+    # warp on the GPU if OpenCV was built with CUDA support and a device exists
+    use_cuda = hasattr(cv2.cuda, "remap") and cv2.cuda.getCudaEnabledDeviceCount()
+    if use_cuda:
+        gpu_src = cv2.cuda_GpuMat()
+        gpu_src.upload(data_bgr)
+        gpu_map_x = cv2.cuda_GpuMat()
+        gpu_map_y = cv2.cuda_GpuMat()
+
+    # warp each phase straight into its slot of a single buffer
+    images = numpy.empty(FLAG_SHAPE, numpy.uint8)
+
+    def warp(indices):
+        map_x = numpy.empty((height, width), dtype=numpy.float32)
+        map_y = numpy.empty((height, width), dtype=numpy.float32)
+        map1 = numpy.empty((height, width, 2), dtype=numpy.int16)
+        for k in indices:
+            numpy.add(id_x, offset_x[k], out=map_x)
+            numpy.add(id_y, offset_y[k], out=map_y)
+
+            if use_cuda:
+                gpu_map_x.upload(map_x)
+                gpu_map_y.upload(map_y)
+                gpu_dst = cv2.cuda.remap(
+                    gpu_src, gpu_map_x, gpu_map_y, cv2.INTER_NEAREST
+                )
+                gpu_dst.download(images[k])
+            else:
+                # the flag is made of flat bands, so nearest neighbour is enough
+                # and integer maps reduce the remap to plain pixel copies
+                cv2.convertMaps(
+                    map_x, map_y, cv2.CV_16SC2, dstmap1=map1, nninterpolation=True
+                )
+                cv2.remap(data_bgr, map1, None, cv2.INTER_NEAREST, dst=images[k])
+
+    if use_cuda:
+        warp(range(30))
+    else:
+        # OpenCV releases the GIL, so spread the phases over several threads,
+        # and stop it from also splitting each remap over its own thread pool
+        workers = min(os.cpu_count() or 1, 30)
+        threads = cv2.getNumThreads()
+        cv2.setNumThreads(1)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                ranges = [range(i, 30, workers) for i in range(workers)]
+                list(executor.map(warp, ranges))
+        finally:
+            cv2.setNumThreads(threads)
+    return images
 
 
 class FlagVideoStreamTrack(VideoStreamTrack):
@@ -26,70 +160,152 @@ class FlagVideoStreamTrack(VideoStreamTrack):
 
     def __init__(self):
         super().__init__()  # don't forget this!
-        self.counter = 0
-        height, width = 480, 640
-
-        # generate flag
-        data_bgr = numpy.hstack(
-            [
-                self._create_rectangle(
-                    width=213, height=480, color=(255, 0, 0)
-                ),  # blue
-                self._create_rectangle(
-                    width=214, height=480, color=(255, 255, 255)
-                ),  # white
-                self._create_rectangle(width=213, height=480, color=(0, 0, 255)),  # red
-            ]
-        )
-
-        # shrink and center it
-        M = numpy.float32([[0.5, 0, width / 4], [0, 0.5, height / 4]])
-        data_bgr = cv2.warpAffine(data_bgr, M, (width, height))
-
-        # compute animation
-        omega = 2 * math.pi / height
-        id_x = numpy.tile(numpy.array(range(width), dtype=numpy.float32), (height, 1))
-        id_y = numpy.tile(
-            numpy.array(range(height), dtype=numpy.float32), (width, 1)
-        ).transpose()
-
-        self.frames = []
-        for k in range(30):
-            phase = 2 * k * math.pi / 30
-            map_x = id_x + 10 * numpy.cos(omega * id_x + phase)
-            map_y = id_y + 10 * numpy.sin(omega * id_x + phase)
-            self.frames.append(
-                VideoFrame.from_ndarray(
-                    cv2.remap(data_bgr, map_x, map_y, cv2.INTER_LINEAR), format="bgr24"
-                )
-            )
+        self._cycle = itertools.cycle(_build_flag_frames())
 
     async def recv(self):
         pts, time_base = await self.next_timestamp()
 
-        frame = self.frames[self.counter % 30]
+        # wrap the shared image on demand rather than keeping 30 frames alive
+        frame = VideoFrame.from_ndarray(next(self._cycle), format="bgr24")
         frame.pts = pts
         frame.time_base = time_base
-        self.counter += 1
         return frame
 
-    def _create_rectangle(self, width, height, color):
-        data_bgr = numpy.zeros((height, width, 3), numpy.uint8)
-        data_bgr[:, :] = color
-        return data_bgr
 
+class StillFlagVideoStreamTrack(FlagVideoStreamTrack):
+    """
+    A video track that returns a still flag at a low frame rate.
+    """
 
-def getSignedURL(method, service, region, host, endpoint):
-    def sign(key, msg):
-        return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+    ptime = 1 / 5  # 5fps
+
+    def __init__(self):
+        super().__init__()
+        self._cycle = itertools.repeat(_build_flag_frames()[0])
+
+    async def next_timestamp(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        if hasattr(self, "_timestamp"):
+            self._timestamp += int(self.ptime * VIDEO_CLOCK_RATE)
+            wait = self._start + (self._timestamp / VIDEO_CLOCK_RATE) - time.time()
+            await asyncio.sleep(wait)
+        else:
+            self._start = time.time()
+            self._timestamp = 0
+        return self._timestamp, VIDEO_TIME_BASE
+
+
+class H264FlagVideoStreamTrack(FlagVideoStreamTrack):
+    """
+    A video track that returns the animated flag as H.264 packets.
+
+    The animation is encoded once, so no encoding takes place while sending.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        # the loop starts with a keyframe, so one is sent on every cycle
+        codec, _ = create_encoder_context(
+            "libx264", width=640, height=480, bitrate=DEFAULT_BITRATE
+        )
+        self.packets = []
+        for i, image in enumerate(_build_flag_frames()):
+            frame = VideoFrame.from_ndarray(image, format="bgr24")
+            frame.pts = i
+            frame.time_base = codec.time_base
+            self.packets.extend(codec.encode(frame))
+        self.packets.extend(codec.encode(None))
+        self._cycle = itertools.cycle(self.packets)
+
+    async def recv(self):
+        pts, time_base = await self.next_timestamp()
+
+        packet = next(self._cycle)
+        packet.pts = pts
+        packet.time_base = time_base
+        return packet
+
+
+def force_codec(pc, sender, forced_codec):
+    kind = forced_codec.split("/")[0]
+    codecs = RTCRtpSender.getCapabilities(kind).codecs
+    transceiver = next(t for t in pc.getTransceivers() if t.sender == sender)
+    transceiver.setCodecPreferences(
+        [codec for codec in codecs if codec.mimeType == forced_codec]
+    )
+
+
+# SHA-256 of the (always empty) request payload
+_EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+
+_ALGORITHM = "AWS4-HMAC-SHA256"
+_SIGNED_HEADERS = "host"
+
+# leading query string parameters, which are the same for every request
+_QUERYSTRING_PREFIX = f"X-Amz-Algorithm={_ALGORITHM}&X-Amz-ChannelARN=" + (
+    urllib.parse.quote(
+        "arn:aws:kinesisvideo:eu-west-2:704753930477:channel/my_test_channel/1691592101264",
+        safe="-_.~",
+    )
+)
+
+
+def sign(key, msg):
+    return hmac.digest(key, msg.encode("utf-8"), "sha256")
+
+
+def getSignatureKey(key, dateStamp, regionName, serviceName):
+    kDate = sign(("AWS4" + key).encode("utf-8"), dateStamp)
+    kRegion = sign(kDate, regionName)
+    kService = sign(kRegion, serviceName)
+    kSigning = sign(kService, "aws4_request")
+    return kSigning
+
+
+# the signing key only changes once per UTC day, so derive it and key the
+# HMAC once, then copy that state for every signature
+@functools.lru_cache(maxsize=4)
+def getSigner(key, dateStamp, regionName, serviceName):
+    signing_key = getSignatureKey(key, dateStamp, regionName, serviceName)
+    return hmac.new(signing_key, digestmod=hashlib.sha256)
+
+
+# the credentials do not change while running, so read and check them once
+@functools.lru_cache(maxsize=1)
+def getCredentials():
+    access_key = os.environ.get("AWS_ACCESS_KEY_ID")
+    secret_key = os.environ.get("AWS_SECRET_ACCESS_KEY")
+    token = os.environ.get("AWS_SESSION_TOKEN")
+
+    if access_key is None or secret_key is None:
+        print("No access key is available.")
+        sys.exit()
 
-    def getSignatureKey(key, dateStamp, regionName, serviceName):
-        kDate = sign(("AWS4" + key).encode("utf-8"), dateStamp)
-        kRegion = sign(kDate, regionName)
-        kService = sign(kRegion, serviceName)
-        kSigning = sign(kService, "aws4_request")
-        return kSigning
+    if access_key.startswith("ASIA"):
+        if token is None:
+            print("Detected temporary credentials. You must specify a token.")
+            sys.exit()
+
+        # percent encode the token and double encode "="
+        security_token = "&X-Amz-Security-Token=" + urllib.parse.quote(
+            token, safe="-_.~"
+        ).replace("=", "%253D")
+    else:
+        security_token = ""
+
+    return access_key, secret_key, security_token
+
+
+# the date only has a one second resolution, so format it once per second
+@functools.lru_cache(maxsize=1)
+def getAmzDate(timestamp):
+    return "%04d%02d%02dT%02d%02d%02dZ" % time.gmtime(timestamp)[:6]
 
+
+def getSignedURL(method, service, region, host, endpoint):
     # ------------------------------------------------------------------
     # Step 2. Define the variables required for the request URL. Replace
     # values for the variables, such as region, with your own values.
@@ -104,11 +320,10 @@ def getSignedURL(method, service, region, host, endpoint):
     endpoint = endpoint
 
     # Create a date for headers and the credential string.
-    t = datetime.datetime.utcnow()
-    amz_date = t.strftime("%Y%m%dT%H%M%SZ")
+    amz_date = getAmzDate(int(time.time()))
 
     # For date stamp, the date without time is used in credential scope.
-    datestamp = t.strftime("%Y%m%d")
+    datestamp = amz_date[:8]
 
     # -----------------------------------------------------------------------
     # Step 3. Create the canonical URI and canonical headers for the request.
@@ -117,8 +332,6 @@ def getSignedURL(method, service, region, host, endpoint):
     # configuration_name = "My_Network_Analyzer_Config"
 
     canonical_headers = "host:" + host + "\n"
-    signed_headers = "host"
-    algorithm = "AWS4-HMAC-SHA256"
     credential_scope = datestamp + "/" + region + "/" + service + "/" + "aws4_request"
 
     # -----------------------------------------------------------------------
@@ -128,116 +341,104 @@ def getSignedURL(method, service, region, host, endpoint):
 
     # IMPORTANT: Best practice is NOT to embed credentials in code.
 
-    access_key = os.environ.get("AWS_ACCESS_KEY_ID")
-    secret_key = os.environ.get("AWS_SECRET_ACCESS_KEY")
-    token = os.environ.get("AWS_SESSION_TOKEN")
-
-    if access_key is None or secret_key is None:
-        print("No access key is available.")
-        sys.exit()
-
-    if access_key.startswith("ASIA") and token is None:
-        print("Detected temporary credentials. You must specify a token.")
-        sys.exit()
+    access_key, secret_key, security_token = getCredentials()
 
     # ----------------------------------------------------------------------
     # Step 5. Create the canonical query string. Query string values must be
     # URI-encoded and sorted by name. Query headers must in alphabetical order.
     # ----------------------------------------------------------------------
-    canonical_querystring = "X-Amz-Algorithm=" + algorithm
-
-    canonical_querystring += "&X-Amz-ChannelARN=" + urllib.parse.quote(
-        "arn:aws:kinesisvideo:eu-west-2:704753930477:channel/my_test_channel/1691592101264",
-        safe="-_.~",
+    credential = urllib.parse.quote(access_key + "/" + credential_scope, safe="-_.~")
+
+    canonical_querystring = (
+        f"{_QUERYSTRING_PREFIX}"
+        f"&X-Amz-Credential={credential}"
+        f"&X-Amz-Date={amz_date}"
+        "&X-Amz-Expires=300"
+        f"{security_token}"
+        f"&X-Amz-SignedHeaders={_SIGNED_HEADERS}"
     )
-
-    canonical_querystring += "&X-Amz-Credential=" + urllib.parse.quote(
-        access_key + "/" + credential_scope, safe="-_.~"
-    )
-
-    canonical_querystring += "&X-Amz-Date=" + amz_date
-    canonical_querystring += "&X-Amz-Expires=300"
-
-    if access_key.startswith("ASIA"):
-        # percent encode the token and double encode "="
-        canonical_querystring += "&X-Amz-Security-Token=" + urllib.parse.quote(
-            token, safe="-_.~"
-        ).replace("=", "%253D")
-
-    canonical_querystring += "&X-Amz-SignedHeaders=" + signed_headers
     # canonical_querystring += "&configuration-name=" + configuration_name
 
     # ----------------------------------------------------------------------
     # Step 6. Create a hash of the payload.
     # ----------------------------------------------------------------------
-    payload_hash = hashlib.sha256(("").encode("utf-8")).hexdigest()
+    payload_hash = _EMPTY_PAYLOAD_HASH
 
     # ------------------------------------------------------------------
     # Step 7. Combine the elements, which includes the query string, the
     # headers, and the payload hash, to form the canonical request.
     # ------------------------------------------------------------------
-    canonical_request = (
-        method
-        + "\n"
-        + canonical_uri
-        + "\n"
-        + canonical_querystring
-        + "\n"
-        + canonical_headers
-        + "\n"
-        + signed_headers
-        + "\n"
-        + payload_hash
-    )
+    canonical_request = "\n".join(
+        [
+            method,
+            canonical_uri,
+            canonical_querystring,
+            canonical_headers,
+            _SIGNED_HEADERS,
+            payload_hash,
+        ]
+    ).encode("utf-8")
 
     # ----------------------------------------------------------------------
     # Step 8. Create the metadata string to store the information required to
     # calculate the signature in the following step.
     # ----------------------------------------------------------------------
-    string_to_sign = (
-        algorithm
-        + "\n"
-        + amz_date
-        + "\n"
-        + credential_scope
-        + "\n"
-        + hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
-    )
+    string_to_sign = "\n".join(
+        [
+            _ALGORITHM,
+            amz_date,
+            credential_scope,
+            hashlib.sha256(canonical_request).hexdigest(),
+        ]
+    ).encode("utf-8")
 
     # ----------------------------------------------------------------------
     # Step 9. Calculate the signature by using a signing key that"s obtained
     # from your secret key.
     # ----------------------------------------------------------------------
     # Create the signing key from your secret key.
-    signing_key = getSignatureKey(secret_key, datestamp, region, service)
+    signer = getSigner(secret_key, datestamp, region, service).copy()
 
     # Sign the string_to_sign using the signing key.
-    signature = hmac.new(
-        signing_key, (string_to_sign).encode("utf-8"), hashlib.sha256
-    ).hexdigest()
+    signer.update(string_to_sign)
+    signature = signer.hexdigest()
 
     # ----------------------------------------------------------------------
     # Step 10. Create the request URL using the calculated signature and by
     # combining it with the canonical URI and the query string.
     # ----------------------------------------------------------------------
-    canonical_querystring += "&X-Amz-Signature=" + signature
-
-    request_url = endpoint + canonical_uri + "?" + canonical_querystring
+    request_url = (
+        f"{endpoint}{canonical_uri}?{canonical_querystring}"
+        f"&X-Amz-Signature={signature}"
+    )
     return request_url
 
 
+# keep idle connections alive and back off adaptively when throttled
+BOTO_CONFIG = botocore.config.Config(retries={"mode": "adaptive"}, tcp_keepalive=True)
+
+
 # function to use boto3 to construct the RTCPeerConfiguration object
-def getRTCPeerConfiguration():
-    client = boto3.client("kinesisvideo")
+async def getRTCPeerConfiguration():
+    loop = asyncio.get_running_loop()
+
+    # boto3 is blocking, so run its calls in the default executor
+    def call(method, *args, **kwargs):
+        return loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
+
+    # share one session so credentials and service models are only loaded once
+    session = boto3.Session()
+    client = await call(session.client, "kinesisvideo", config=BOTO_CONFIG)
 
     # get the channel ARN
-    channelARNResponse = client.describe_signaling_channel(
-        ChannelName="my_test_channel"
+    channelARNResponse = await call(
+        client.describe_signaling_channel, ChannelName="my_test_channel"
     )
     channelARN = channelARNResponse["ChannelInfo"]["ChannelARN"]
 
     # get the signalling channel endpoint
-    response = client.get_signaling_channel_endpoint(
+    response = await call(
+        client.get_signaling_channel_endpoint,
         ChannelARN=channelARN,
         SingleMasterChannelEndpointConfiguration={
             # This property is used to determine the nature of communication over this SINGLE_MASTER signaling channel.
@@ -261,8 +462,14 @@ def getRTCPeerConfiguration():
     }
 
     # get the ice server configuration
-    client = boto3.client("kinesis-video-signaling", endpoint_url=endpoints["HTTPS"])
-    response = client.get_ice_server_config(
+    client = await call(
+        session.client,
+        "kinesis-video-signaling",
+        endpoint_url=endpoints["HTTPS"],
+        config=BOTO_CONFIG,
+    )
+    response = await call(
+        client.get_ice_server_config,
         ChannelARN=channelARN,
     )
 
@@ -287,26 +494,29 @@ def getRTCPeerConfiguration():
     return endpoints, RTCConfiguration(iceServerList)
 
 
-async def run(pc, player, recorder, signaling, role, remoteClientId=None):
+async def run(pc, player, recorder, signaling, role, remoteClientId=None, flag=None):
     def add_tracks():
         if player and player.audio:
             pc.addTrack(player.audio)
 
         if player and player.video:
             pc.addTrack(player.video)
-        else:
-            pc.addTrack(FlagVideoStreamTrack())
+        elif not any(sender.track is flag for sender in pc.getSenders()):
+            # the flag is built once, renegotiations keep its sender
+            sender = pc.addTrack(flag)
+            if isinstance(flag, H264FlagVideoStreamTrack):
+                force_codec(pc, sender, "video/H264")
 
     @pc.on("track")
     def on_track(track):
-        print("Receiving %s" % track.kind)
+        logger.debug("Receiving %s", track.kind)
         recorder.addTrack(track)
 
     # connect signaling
-    print("Connecting to signaling server")
+    logger.debug("Connecting to signaling server")
     # connect signaling
     await signaling.connect()
-    print("Connected to signaling server")
+    logger.info("Connected to signaling server")
 
     # # based on
     # # https://w3c.github.io/webrtc-pc/#perfect-negotiation-example
@@ -327,102 +537,105 @@ async def run(pc, player, recorder, signaling, role, remoteClientId=None):
         await pc.setLocalDescription(offer)
         await signaling.send(offer, senderClientId="test")
 
-    while True:
-        # await asyncio.sleep(2)
-        obj, remoteClientId = await signaling.receive()
-        # print("Received %s" % obj.type)
-        # print("ConnectionState %s" % pc.connectionState)
-        # print("SignalingState %s" % pc.signalingState)
-        # print("IceConnectionState %s" % pc.iceConnectionState)
-        # print("IceGatheringState %s" % pc.iceGatheringState)
-
-        if pc.connectionState == "failed":
-            print("Connection failed")
-            break
-        elif isinstance(obj, RTCSessionDescription):
-            print("========= offer or answer: " + obj.type)
-            # // An offer may come in while we are busy processing SRD(answer).
-            # // In this case, we will be in "stable" by the time the offer is processed
-            # // so it is safe to chain it on our Operations Chain now.
-            # readyForOffer = not makingOffer and (
-            #     pc.signalingState == "stable" or isSettingRemoteAnswerPending
-            # )
-            # offerCollision = obj.type == "offer" and not readyForOffer
-
-            # ignoreOffer = not polite and offerCollision
-            # if ignoreOffer:
-            #     continue
-
-            # isSettingRemoteAnswerPending = obj.type == "answer"
-
-            # print("**********************")
-            # print("readyForOffer %s" % readyForOffer)
-            # print("ignoreOffer %s" % ignoreOffer)
-            # print("offerCollision %s" % offerCollision)
-            # print("isSettingRemoteAnswerPending %s" % isSettingRemoteAnswerPending)
-            # print("**********************")
-
-            print("Setting remote description")
-            # print(obj)
-            await pc.setRemoteDescription(obj)
-            print("Remote description set")
-
-            # SRD rolls back as needed
-            await recorder.start()
-            print("Recorder started")
-
-            # isSettingRemoteAnswerPending = False
-
-            # if obj.type == "offer":
-            # print("2")
-            # print("**********************")
-            # print("readyForOffer %s" % readyForOffer)
-            # print("ignoreOffer %s" % ignoreOffer)
-            # print("offerCollision %s" % offerCollision)
-            # print("isSettingRemoteAnswerPending %s" % isSettingRemoteAnswerPending)
-            # print("**********************")
-
-            # print("icegatheringstate1: %s" % pc.iceGatheringState)
-            if obj.type == "offer":
-                print("========= Sending answer")
-                # send answer
-                print("Send answer")
-                add_tracks()
-                # print("icegatheringstate2: %s" % pc.iceGatheringState)
-                answer = await pc.createAnswer()
-                # print("icegatheringstate3: %s" % pc.iceGatheringState)
-                await pc.setLocalDescription(answer)
-                # print("icegatheringstate4: %s" % pc.iceGatheringState)
-
-                print("going to send answer")
-                await signaling.send(answer, recipientClientId=remoteClientId)
-                # await asyncio.sleep(10)  # yield control to the event loop
-
-        elif isinstance(obj, RTCIceCandidate):
-            print("========= Adding ice candidate")
-            await pc.addIceCandidate(obj)
-
-            print("ConnectionState %s" % pc.connectionState)
+    recorder_tasks = []
+    try:
+        while True:
+            # await asyncio.sleep(2)
+            obj, remoteClientId = await signaling.receive()
+            # print("Received %s" % obj.type)
+            # print("ConnectionState %s" % pc.connectionState)
             # print("SignalingState %s" % pc.signalingState)
             # print("IceConnectionState %s" % pc.iceConnectionState)
             # print("IceGatheringState %s" % pc.iceGatheringState)
 
-            # # do we have enough candidates yet to start the stream?
-            # if pc.iceGatheringState == "complete":
-            #     # send the ice candidate back to the other party
-            #     # await signaling.send(obj)
-            #     # send offer
-            #     # makingOffer = True
-            #     add_tracks()
-            #     await pc.setLocalDescription(await pc.createOffer())
-            #     await signaling.send(pc.localDescription, senderClientId)
-            # await asyncio.sleep(2)
-
-        elif obj is BYE:
-            print("========= Exiting")
-            break
+            if pc.connectionState == "failed":
+                logger.info("Connection failed")
+                break
+            elif isinstance(obj, RTCSessionDescription):
+                logger.debug("Received %s", obj.type)
+                # // An offer may come in while we are busy processing SRD(answer).
+                # // In this case, we will be in "stable" by the time the offer is processed
+                # // so it is safe to chain it on our Operations Chain now.
+                # readyForOffer = not makingOffer and (
+                #     pc.signalingState == "stable" or isSettingRemoteAnswerPending
+                # )
+                # offerCollision = obj.type == "offer" and not readyForOffer
+
+                # ignoreOffer = not polite and offerCollision
+                # if ignoreOffer:
+                #     continue
+
+                # isSettingRemoteAnswerPending = obj.type == "answer"
+
+                # print("**********************")
+                # print("readyForOffer %s" % readyForOffer)
+                # print("ignoreOffer %s" % ignoreOffer)
+                # print("offerCollision %s" % offerCollision)
+                # print("isSettingRemoteAnswerPending %s" % isSettingRemoteAnswerPending)
+                # print("**********************")
+
+                logger.debug("Setting remote description")
+                # print(obj)
+                await pc.setRemoteDescription(obj)
+                logger.debug("Remote description set")
+
+                # SRD rolls back as needed, start the recorder without delaying
+                # the answer
+                recorder_tasks.append(asyncio.ensure_future(recorder.start()))
+
+                # isSettingRemoteAnswerPending = False
+
+                # if obj.type == "offer":
+                # print("2")
+                # print("**********************")
+                # print("readyForOffer %s" % readyForOffer)
+                # print("ignoreOffer %s" % ignoreOffer)
+                # print("offerCollision %s" % offerCollision)
+                # print("isSettingRemoteAnswerPending %s" % isSettingRemoteAnswerPending)
+                # print("**********************")
+
+                # print("icegatheringstate1: %s" % pc.iceGatheringState)
+                if obj.type == "offer":
+                    # send answer
+                    add_tracks()
+                    # print("icegatheringstate2: %s" % pc.iceGatheringState)
+                    answer = await pc.createAnswer()
+                    # print("icegatheringstate3: %s" % pc.iceGatheringState)
+                    await pc.setLocalDescription(answer)
+                    # print("icegatheringstate4: %s" % pc.iceGatheringState)
+
+                    logger.debug("Sending answer")
+                    await signaling.send(answer, recipientClientId=remoteClientId)
+                    # await asyncio.sleep(10)  # yield control to the event loop
+
+            elif isinstance(obj, RTCIceCandidate):
+                logger.debug("Adding ICE candidate")
+                await pc.addIceCandidate(obj)
+
+                logger.debug("Connection state is %s", pc.connectionState)
+                # print("SignalingState %s" % pc.signalingState)
+                # print("IceConnectionState %s" % pc.iceConnectionState)
+                # print("IceGatheringState %s" % pc.iceGatheringState)
+
+                # # do we have enough candidates yet to start the stream?
+                # if pc.iceGatheringState == "complete":
+                #     # send the ice candidate back to the other party
+                #     # await signaling.send(obj)
+                #     # send offer
+                #     # makingOffer = True
+                #     add_tracks()
+                #     await pc.setLocalDescription(await pc.createOffer())
+                #     await signaling.send(pc.localDescription, senderClientId)
+                # await asyncio.sleep(2)
+
+            elif obj is BYE:
+                logger.debug("Exiting")
+                break
 
-        # await asyncio.sleep(2)
+            # await asyncio.sleep(2)
+    finally:
+        # retrieve the recorder start results even if the loop was aborted
+        await asyncio.gather(*recorder_tasks)
 
 
 if __name__ == "__main__":
@@ -431,15 +644,52 @@ if __name__ == "__main__":
     parser.add_argument("--remoteClientId", help="Remote client ID to connect to."),
     parser.add_argument("--play-from", help="Read the media from a file and sent it."),
     parser.add_argument("--record-to", help="Write received media to a file."),
+    flag_group = parser.add_mutually_exclusive_group()
+    flag_group.add_argument(
+        "--pre-encode",
+        action="store_true",
+        help="Encode the animated flag to H.264 once instead of for every frame.",
+    )
+    flag_group.add_argument(
+        "--still",
+        action="store_true",
+        help="Send a still flag at a low frame rate instead of the animation.",
+    )
     parser.add_argument("--verbose", "-v", action="count")
     add_signaling_arguments(parser)
     args = parser.parse_args()
 
     if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
         logging.basicConfig(level=logging.INFO)
 
-    # get the endpoints and configuration, update args.signaling_host
-    endpoints, configuration = getRTCPeerConfiguration()
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    # create media source
+    if args.play_from:
+        player = MediaPlayer(args.play_from)
+    else:
+        player = None
+
+    # get the endpoints and configuration while the flag animation is computed
+    loop = asyncio.get_event_loop()
+    if player and player.video:
+        flag = None
+        endpoints, configuration = loop.run_until_complete(getRTCPeerConfiguration())
+    else:
+        if args.pre_encode:
+            flag_factory = H264FlagVideoStreamTrack
+        elif args.still:
+            flag_factory = StillFlagVideoStreamTrack
+        else:
+            flag_factory = FlagVideoStreamTrack
+        (endpoints, configuration), flag = loop.run_until_complete(
+            asyncio.gather(
+                getRTCPeerConfiguration(), loop.run_in_executor(None, flag_factory)
+            )
+        )
 
     # Prepare a GetCallerIdentity request.
     service = "kinesisvideo"
@@ -456,19 +706,13 @@ if __name__ == "__main__":
     args.signaling_port = 443
     args.signaling = "websocket"
 
-    print(endpoints)
+    logger.debug("Signaling endpoints %s", endpoints)
 
     # create signaling and peer connection
-    print("Creating signaling and peer connection")
+    logger.debug("Creating signaling and peer connection")
     signaling = create_signaling(args)
     pc = RTCPeerConnection(configuration)
 
-    # create media source
-    if args.play_from:
-        player = MediaPlayer(args.play_from)
-    else:
-        player = None
-
     # create media sink
     if args.record_to:
         recorder = MediaRecorder(args.record_to)
@@ -476,7 +720,6 @@ if __name__ == "__main__":
         recorder = MediaBlackhole()
 
     # run event loop
-    loop = asyncio.get_event_loop()
     try:
         loop.run_until_complete(
             run(
@@ -486,6 +729,7 @@ if __name__ == "__main__":
                 signaling=signaling,
                 role=args.role,
                 remoteClientId=args.remoteClientId,
+                flag=flag,
             )
         )
     except KeyboardInterrupt:
@@ -1,4 +1,5 @@
 import asyncio
+import functools
 import json
 import logging
 import os
@@ -11,89 +12,123 @@ from aiortc.sdp import candidate_from_sdp, candidate_to_sdp
 
 logger = logging.getLogger(__name__)
 BYE = object()
+BYE_MESSAGE = json.dumps({"action": "BYE"})
 
-logging.basicConfig(level=logging.INFO)
+
+def description_from_payload(payload):
+    return RTCSessionDescription(**payload)
+
+
+def candidate_from_payload(payload):
+    sdp = payload["candidate"]
+    if not sdp:
+        # end of candidates
+        return None
+    if sdp.startswith("candidate:"):
+        sdp = sdp[10:]
+    candidate = candidate_from_sdp(sdp)
+    candidate.sdpMid = payload["sdpMid"]
+    candidate.sdpMLineIndex = payload["sdpMLineIndex"]
+    return candidate
+
+
+# parsers for the payload of each message type
+FROM_PAYLOAD = {
+    "SDP_OFFER": description_from_payload,
+    "SDP_ANSWER": description_from_payload,
+    "ICE_CANDIDATE": candidate_from_payload,
+}
 
 
 def object_from_string(message_str):
     message = json.loads(message_str)
-    print("message received xxx:" + message_str)
-    payload = base64.b64decode(message["messagePayload"])
-    senderClientId = message["senderClientId"]
-    encrypted_message = json.loads(payload)
-    if "type" in encrypted_message and encrypted_message["type"] in ["answer", "offer"]:
-        return RTCSessionDescription(**encrypted_message), senderClientId
-    elif message["messageType"] == "ICE_CANDIDATE" and encrypted_message["candidate"]:
-        candidate = candidate_from_sdp(encrypted_message["candidate"].split(":", 1)[1])
-        candidate.sdpMid = encrypted_message["sdpMid"]
-        candidate.sdpMLineIndex = encrypted_message["sdpMLineIndex"]
-        return candidate, senderClientId
-    elif message["messageType"] == "BYE":
+    logger.debug("message received: %s", message_str)
+    # messages from another aiortc peer carry the "action" which was sent
+    messageType = message.get("messageType", message.get("action"))
+    senderClientId = message.get("senderClientId")
+    if messageType == "BYE":
         return BYE, senderClientId
 
+    from_payload = FROM_PAYLOAD.get(messageType)
+    if from_payload is None:
+        return None, senderClientId
+    payload = json.loads(base64.b64decode(message["messagePayload"]))
+    return from_payload(payload), senderClientId
 
-def object_to_string(obj, senderClientId=None, recipientClientId=None):
-    if isinstance(obj, RTCSessionDescription) and obj.type == "offer":
-        payload = {
-            "sdp": obj.sdp,
-            "type": obj.type,
-        }
-        message = {
-            "messagePayload": base64.b64encode(
-                json.dumps(payload).encode("utf8")
-            ).decode("utf8"),
-            "action": "SDP_OFFER",
-            "recipientClientId": recipientClientId,
-            "senderClientId": senderClientId,
-        }
-    elif isinstance(obj, RTCSessionDescription) and obj.type == "answer":
-        payload = {
-            "sdp": obj.sdp,
-            "type": obj.type,
-        }
-        message = {
-            "messagePayload": base64.b64encode(
-                json.dumps(payload).encode("utf8")
-            ).decode("utf8"),
-            "action": "SDP_ANSWER",
-            "recipientClientId": recipientClientId,
-            "senderClientId": senderClientId,
-        }
-    elif isinstance(obj, RTCIceCandidate):
-        payload = {
-            "candidate": candidate_to_sdp(obj),
+
+DESCRIPTION_ACTIONS = {"offer": "SDP_OFFER", "answer": "SDP_ANSWER"}
+
+
+def encode_payload(payload):
+    return base64.b64encode(json.dumps(payload).encode("utf8")).decode("utf8")
+
+
+# the same description is often sent several times, e.g. to several viewers
+@functools.lru_cache(maxsize=16)
+def encode_description(sdp, type):
+    return encode_payload({"sdp": sdp, "type": type})
+
+
+# client ids stay the same for a whole session, so only escape them once
+@functools.lru_cache(maxsize=16)
+def encode_client_id(clientId):
+    return json.dumps(clientId)
+
+
+def description_to_payload(obj):
+    return DESCRIPTION_ACTIONS[obj.type], encode_description(obj.sdp, obj.type)
+
+
+def candidate_to_payload(obj):
+    return "ICE_CANDIDATE", encode_payload(
+        {
+            "candidate": "candidate:" + candidate_to_sdp(obj),
             "sdpMid": obj.sdpMid,
             "sdpMLineIndex": obj.sdpMLineIndex,
         }
-        message = {
-            "messagePayload": base64.b64encode(
-                json.dumps(payload).encode("utf8")
-            ).decode("utf8"),
-            "action": "ICE_CANDIDATE",
-            "recipientClientId": recipientClientId,
-            "senderClientId": senderClientId,
-        }
-    else:
-        assert obj is BYE or obj is None
-        message = {"action": "BYE"}
-    print("message sent xxx:" + json.dumps(message, sort_keys=True))
-    return json.dumps(message.dict(exclude_none=True), sort_keys=True)
+    )
+
+
+# builders of the action and encoded payload for each type of object
+TO_PAYLOAD = {
+    RTCSessionDescription: description_to_payload,
+    RTCIceCandidate: candidate_to_payload,
+}
+
+
+def object_to_string(obj, senderClientId=None, recipientClientId=None):
+    if obj is BYE or obj is None:
+        return BYE_MESSAGE
+
+    # the payload is base64 which never needs escaping, so only the client ids
+    # go through the JSON encoder
+    action, payload = TO_PAYLOAD[type(obj)](obj)
+    fields = ['"action": "%s", "messagePayload": "%s"' % (action, payload)]
+    if recipientClientId is not None:
+        fields.append('"recipientClientId": %s' % encode_client_id(recipientClientId))
+    if senderClientId is not None:
+        fields.append('"senderClientId": %s' % encode_client_id(senderClientId))
+    data = "{%s}" % ", ".join(fields)
+    logger.debug("message sent: %s", data)
+    return data
 
 
 class CopyAndPasteSignaling:
     def __init__(self):
+        self._read_encoding = None
         self._read_pipe = sys.stdin
         self._read_transport = None
         self._reader = None
         self._write_pipe = sys.stdout
 
     async def connect(self):
-        loop = asyncio.get_event_loop()
-        self._reader = asyncio.StreamReader(loop=loop)
+        loop = asyncio.get_running_loop()
+        self._reader = asyncio.StreamReader()
         self._read_transport, _ = await loop.connect_read_pipe(
             lambda: asyncio.StreamReaderProtocol(self._reader), self._read_pipe
         )
-        print("connected to signaling server via copy-and-paste")
+        self._read_encoding = self._read_pipe.encoding or "utf8"
+        logger.info("connected to signaling server via copy-and-paste")
 
     async def close(self):
         if self._reader is not None:
@@ -102,22 +137,21 @@ class CopyAndPasteSignaling:
             self._reader = None
 
     async def receive(self):
-        print("-- Please enter a message from remote party --")
+        logger.info("-- Please enter a message from remote party --")
         data = await self._reader.readline()
-        print()
-        return object_from_string(data.decode(self._read_pipe.encoding))
+        return object_from_string(data.decode(self._read_encoding))
 
     async def send(self, descr):
-        print("-- Please send this message to the remote party --")
+        logger.info("-- Please send this message to the remote party --")
         self._write_pipe.write(object_to_string(descr) + "\n")
         self._write_pipe.flush()
-        print()
 
 
 class TcpSocketSignaling:
     def __init__(self, host, port):
         self._host = host
         self._port = port
+        self._connecting = None
         self._server = None
         self._reader = None
         self._writer = None
@@ -129,6 +163,18 @@ class TcpSocketSignaling:
         if self._writer is not None:
             return
 
+        # concurrent callers wait for the same connection attempt
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._open(server))
+        connecting = self._connecting
+        try:
+            # a cancelled caller must not abort the attempt for the others
+            await asyncio.shield(connecting)
+        finally:
+            if self._connecting is connecting and connecting.done():
+                self._connecting = None
+
+    async def _open(self, server):
         if server:
             connected = asyncio.Event()
 
@@ -140,14 +186,28 @@ class TcpSocketSignaling:
             self._server = await asyncio.start_server(
                 client_connected, host=self._host, port=self._port
             )
-            await connected.wait()
+            try:
+                await connected.wait()
+            except asyncio.CancelledError:
+                if self._server is not None:
+                    self._server.close()
+                    self._server = None
+                raise
         else:
             self._reader, self._writer = await asyncio.open_connection(
                 host=self._host, port=self._port
             )
-        print("connected to signaling server via tcp-socket")
+        logger.info("connected to signaling server via tcp-socket")
 
     async def close(self):
+        # abandon a connection attempt no caller is waiting for any more
+        if self._connecting is not None:
+            self._connecting.cancel()
+            try:
+                await self._connecting
+            except (asyncio.CancelledError, OSError):
+                pass
+            self._connecting = None
         if self._writer is not None:
             await self.send(BYE)
             self._writer.close()
@@ -168,12 +228,13 @@ class TcpSocketSignaling:
     async def send(self, descr):
         await self._connect(True)
         data = object_to_string(descr).encode("utf8")
-        self._writer.write(data + b"\n")
+        self._writer.writelines((data, b"\n"))
 
 
 class UnixSocketSignaling:
     def __init__(self, path):
         self._path = path
+        self._connecting = None
         self._server = None
         self._reader = None
         self._writer = None
@@ -185,6 +246,18 @@ class UnixSocketSignaling:
         if self._writer is not None:
             return
 
+        # concurrent callers wait for the same connection attempt
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._open(server))
+        connecting = self._connecting
+        try:
+            # a cancelled caller must not abort the attempt for the others
+            await asyncio.shield(connecting)
+        finally:
+            if self._connecting is connecting and connecting.done():
+                self._connecting = None
+
+    async def _open(self, server):
         if server:
             connected = asyncio.Event()
 
@@ -196,12 +269,28 @@ class UnixSocketSignaling:
             self._server = await asyncio.start_unix_server(
                 client_connected, path=self._path
             )
-            await connected.wait()
+            try:
+                await connected.wait()
+            except asyncio.CancelledError:
+                if self._server is not None:
+                    self._server.close()
+                    self._server = None
+                if os.path.exists(self._path):
+                    os.unlink(self._path)
+                raise
         else:
             self._reader, self._writer = await asyncio.open_unix_connection(self._path)
-        print("connected to signaling server via unix-socket")
+        logger.info("connected to signaling server via unix-socket")
 
     async def close(self):
+        # abandon a connection attempt no caller is waiting for any more
+        if self._connecting is not None:
+            self._connecting.cancel()
+            try:
+                await self._connecting
+            except (asyncio.CancelledError, OSError):
+                pass
+            self._connecting = None
         if self._writer is not None:
             await self.send(BYE)
             self._writer.close()
@@ -223,7 +312,7 @@ class UnixSocketSignaling:
     async def send(self, descr):
         await self._connect(True)
         data = object_to_string(descr).encode("utf8")
-        self._writer.write(data + b"\n")
+        self._writer.writelines((data, b"\n"))
 
 
 class WebsocketSignaling:
@@ -233,13 +322,7 @@ class WebsocketSignaling:
         self._websocket = None
 
     async def connect(self):
-        # websocket.enableTrace(True)
-
         self._websocket = await websockets.connect(str(self._host))
-        # self._websocket = await websocket.create_connection(
-        #     url=str(self._host),
-        #     # header=headers,
-        # )
 
     async def close(self):
         if self._websocket is not None and self._websocket.open is True:
@@ -247,26 +330,24 @@ class WebsocketSignaling:
             await self._websocket.close()
 
     async def receive(self):
-        try:
-            data = await self._websocket.recv()
-            while data is None or data == "" or "Endpoint request timed out" in data:
-                await asyncio.sleep(0.1)
-                data = await self._websocket.recv()
-        except asyncio.IncompleteReadError:
-            print("got no data")
-            return
+        # skip the empty keep-alives and timeout notices sent by the endpoint
+        async for data in self._websocket:
+            if data and "Endpoint request timed out" not in data:
+                break
+        else:
+            logger.debug("signaling connection closed")
+            return BYE, None
+
         ret, senderClientId = object_from_string(data)
-        if ret == None:
-            print("remote host says good bye!")
+        if ret is BYE:
+            logger.debug("remote host says good bye!")
 
         return ret, senderClientId
 
     async def send(self, descr, senderClientId=None, recipientClientId=None):
-        print("sending data")
         if descr is not None:
-            print(descr)
             data = object_to_string(descr, senderClientId, recipientClientId)
-            await self._websocket.send(data + "\n")
+            await self._websocket.send(data)
 
 
 def add_signaling_arguments(parser):
@@ -1,5 +1,7 @@
 import argparse
 import asyncio
+import base64
+import json
 import os
 from unittest import TestCase
 
@@ -24,6 +26,15 @@ offer = RTCSessionDescription(sdp="some-offer", type="offer")
 answer = RTCSessionDescription(sdp="some-answer", type="answer")
 
 
+def kvs_message(messageType, payload=None):
+    message = {"messageType": messageType, "senderClientId": "some-client"}
+    if payload is not None:
+        message["messagePayload"] = base64.b64encode(
+            json.dumps(payload).encode("utf8")
+        ).decode("utf8")
+    return json.dumps(message)
+
+
 class SignalingTest(TestCase):
     def setUp(self):
         def mock_print(*args, **kwargs):
@@ -59,10 +70,10 @@ class SignalingTest(TestCase):
         await sig_client.connect()
 
         res = await asyncio.gather(sig_server.send(offer), delay(sig_client.receive))
-        self.assertEqual(res[1], offer)
+        self.assertEqual(res[1][0], offer)
 
         res = await asyncio.gather(sig_client.send(answer), delay(sig_server.receive))
-        self.assertEqual(res[1], answer)
+        self.assertEqual(res[1][0], answer)
 
         await asyncio.gather(sig_server.close(), sig_client.close())
 
@@ -84,10 +95,10 @@ class SignalingTest(TestCase):
         await sig_client.connect()
 
         res = await asyncio.gather(sig_server.send(offer), delay(sig_client.receive))
-        self.assertEqual(res[1], offer)
+        self.assertEqual(res[1][0], offer)
 
         res = await asyncio.gather(sig_client.send(answer), delay(sig_server.receive))
-        self.assertEqual(res[1], answer)
+        self.assertEqual(res[1][0], answer)
 
         await asyncio.gather(sig_server.close(), sig_client.close())
 
@@ -105,7 +116,7 @@ class SignalingTest(TestCase):
         await sig_client.connect()
 
         res = await asyncio.gather(sig_server.send(offer), delay(sig_client.receive))
-        self.assertEqual(res[1], offer)
+        self.assertEqual(res[1][0], offer)
 
         # break connection
         sig_client._writer.close()
@@ -119,6 +130,63 @@ class SignalingTest(TestCase):
 
         await asyncio.gather(sig_server.close(), sig_client.close())
 
+    @asynctest
+    async def test_tcp_socket_concurrent_connect(self):
+        parser = argparse.ArgumentParser()
+        add_signaling_arguments(parser)
+        args = parser.parse_args(["-s", "tcp-socket"])
+
+        sig_server = create_signaling(args)
+        sig_client = create_signaling(args)
+
+        # connect
+        await sig_server.connect()
+        await sig_client.connect()
+
+        async def answer_offer():
+            obj, _ = await sig_client.receive()
+            await sig_client.send(answer)
+            return obj
+
+        # send() and receive() share a single connection attempt
+        res = await asyncio.gather(
+            sig_server.send(offer), sig_server.receive(), delay(answer_offer)
+        )
+        self.assertEqual(res[1][0], answer)
+        self.assertEqual(res[2], offer)
+
+        await asyncio.gather(sig_server.close(), sig_client.close())
+
+    @asynctest
+    async def test_tcp_socket_close_while_connecting(self):
+        parser = argparse.ArgumentParser()
+        add_signaling_arguments(parser)
+        args = parser.parse_args(["-s", "tcp-socket"])
+
+        sig_server = create_signaling(args)
+        sig_client = create_signaling(args)
+
+        # connect
+        await sig_server.connect()
+        await sig_client.connect()
+
+        # give up on sending while no client has connected
+        send = asyncio.ensure_future(sig_server.send(offer))
+        await asyncio.sleep(0.1)
+        send.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await send
+
+        await sig_server.close()
+        self.assertIsNone(sig_server._connecting)
+        self.assertIsNone(sig_server._server)
+
+        # the instance can connect again
+        res = await asyncio.gather(sig_server.send(offer), delay(sig_client.receive))
+        self.assertEqual(res[1][0], offer)
+
+        await asyncio.gather(sig_server.close(), sig_client.close())
+
     @asynctest
     async def test_unix_socket(self):
         parser = argparse.ArgumentParser()
@@ -133,10 +201,10 @@ class SignalingTest(TestCase):
         await sig_client.connect()
 
         res = await asyncio.gather(sig_server.send(offer), delay(sig_client.receive))
-        self.assertEqual(res[1], offer)
+        self.assertEqual(res[1][0], offer)
 
         res = await asyncio.gather(sig_client.send(answer), delay(sig_server.receive))
-        self.assertEqual(res[1], answer)
+        self.assertEqual(res[1][0], answer)
 
         await asyncio.gather(sig_server.close(), sig_client.close())
 
@@ -154,7 +222,7 @@ class SignalingTest(TestCase):
         await sig_client.connect()
 
         res = await asyncio.gather(sig_server.send(offer), delay(sig_client.receive))
-        self.assertEqual(res[1], offer)
+        self.assertEqual(res[1][0], offer)
 
         # break connection
         sig_client._writer.close()
@@ -168,19 +236,85 @@ class SignalingTest(TestCase):
 
         await asyncio.gather(sig_server.close(), sig_client.close())
 
+    @asynctest
+    async def test_unix_socket_concurrent_connect(self):
+        parser = argparse.ArgumentParser()
+        add_signaling_arguments(parser)
+        args = parser.parse_args(["-s", "unix-socket"])
+
+        sig_server = create_signaling(args)
+        sig_client = create_signaling(args)
+
+        # connect
+        await sig_server.connect()
+        await sig_client.connect()
+
+        async def answer_offer():
+            obj, _ = await sig_client.receive()
+            await sig_client.send(answer)
+            return obj
+
+        # send() and receive() share a single connection attempt
+        res = await asyncio.gather(
+            sig_server.send(offer), sig_server.receive(), delay(answer_offer)
+        )
+        self.assertEqual(res[1][0], answer)
+        self.assertEqual(res[2], offer)
+
+        await asyncio.gather(sig_server.close(), sig_client.close())
+
+    @asynctest
+    async def test_unix_socket_close_while_connecting(self):
+        parser = argparse.ArgumentParser()
+        add_signaling_arguments(parser)
+        args = parser.parse_args(["-s", "unix-socket"])
+
+        sig_server = create_signaling(args)
+        sig_client = create_signaling(args)
+
+        # connect
+        await sig_server.connect()
+        await sig_client.connect()
+
+        # give up on sending while no client has connected
+        send = asyncio.ensure_future(sig_server.send(offer))
+        await asyncio.sleep(0.1)
+        send.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await send
+
+        await sig_server.close()
+        self.assertIsNone(sig_server._connecting)
+        self.assertIsNone(sig_server._server)
+        self.assertFalse(os.path.exists(args.signaling_path))
+
+        # the instance can connect again
+        res = await asyncio.gather(sig_server.send(offer), delay(sig_client.receive))
+        self.assertEqual(res[1][0], offer)
+
+        await asyncio.gather(sig_server.close(), sig_client.close())
+
 
 class SignalingUtilsTest(TestCase):
     def test_bye_from_string(self):
-        self.assertEqual(object_from_string('{"type": "bye"}'), BYE)
+        self.assertEqual(object_from_string(kvs_message("BYE")), (BYE, "some-client"))
 
     def test_bye_to_string(self):
-        self.assertEqual(object_to_string(BYE), '{"type": "bye"}')
+        self.assertEqual(object_to_string(BYE), '{"action": "BYE"}')
 
     def test_candidate_from_string(self):
-        candidate = object_from_string(
-            '{"candidate": "candidate:0 1 UDP 2122252543 192.168.99.7 33543 typ host", '
-            '"id": "audio", "label": 0, "type": "candidate"}'
+        candidate, senderClientId = object_from_string(
+            kvs_message(
+                "ICE_CANDIDATE",
+                {
+                    "candidate": "candidate:0 1 UDP 2122252543 "
+                    "192.168.99.7 33543 typ host",
+                    "sdpMid": "audio",
+                    "sdpMLineIndex": 0,
+                },
+            )
         )
+        self.assertEqual(senderClientId, "some-client")
         self.assertEqual(candidate.component, 1)
         self.assertEqual(candidate.foundation, "0")
         self.assertEqual(candidate.ip, "192.168.99.7")
@@ -191,6 +325,30 @@ class SignalingUtilsTest(TestCase):
         self.assertEqual(candidate.sdpMLineIndex, 0)
         self.assertEqual(candidate.type, "host")
 
+    def test_end_of_candidates_from_string(self):
+        self.assertEqual(
+            object_from_string(
+                kvs_message(
+                    "ICE_CANDIDATE",
+                    {"candidate": "", "sdpMid": "0", "sdpMLineIndex": 0},
+                )
+            ),
+            (None, "some-client"),
+        )
+
+    def test_offer_from_string(self):
+        self.assertEqual(
+            object_from_string(
+                kvs_message("SDP_OFFER", {"sdp": "some-offer", "type": "offer"})
+            ),
+            (offer, "some-client"),
+        )
+
+    def test_unknown_from_string(self):
+        self.assertEqual(
+            object_from_string(kvs_message("STATUS_RESPONSE")), (None, "some-client")
+        )
+
     def test_candidate_to_string(self):
         candidate = RTCIceCandidate(
             component=1,
@@ -203,8 +361,32 @@ class SignalingUtilsTest(TestCase):
         )
         candidate.sdpMid = "audio"
         candidate.sdpMLineIndex = 0
+        message = json.loads(
+            object_to_string(candidate, recipientClientId="some-client")
+        )
+        self.assertEqual(
+            message,
+            {
+                "action": "ICE_CANDIDATE",
+                "messagePayload": message["messagePayload"],
+                "recipientClientId": "some-client",
+            },
+        )
+        self.assertEqual(
+            json.loads(base64.b64decode(message["messagePayload"])),
+            {
+                "candidate": "candidate:0 1 UDP 2122252543 192.168.99.7 33543 typ host",
+                "sdpMid": "audio",
+                "sdpMLineIndex": 0,
+            },
+        )
+
+    def test_offer_to_string(self):
+        message = json.loads(object_to_string(offer, senderClientId="some-client"))
+        self.assertEqual(message["action"], "SDP_OFFER")
+        self.assertEqual(message["senderClientId"], "some-client")
+        self.assertNotIn("recipientClientId", message)
         self.assertEqual(
-            object_to_string(candidate),
-            '{"candidate": "candidate:0 1 UDP 2122252543 192.168.99.7 33543 typ host", '
-            '"id": "audio", "label": 0, "type": "candidate"}',
+            json.loads(base64.b64decode(message["messagePayload"])),
+            {"sdp": "some-offer", "type": "offer"},
         )